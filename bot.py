@@ -1,9 +1,16 @@
+import asyncio
+import atexit
+import collections
 import logging
 import os
-import hashlib
-import time
+import re
+import secrets
 import sqlite3
+import threading
+from contextlib import contextmanager
 from datetime import datetime, timedelta
+from typing import Optional, Union
+from cachetools import LRUCache, TTLCache
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import (
     Application,
@@ -28,89 +35,319 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# ================= MESSAGES =================
+WELCOME_TEMPLATE = (
+    "👋 Hello {name}!\n\n"
+    "I'm a URL sharing bot. "
+    "Only the admin can generate shareable Telegram links.\n\n"
+    "🔗 *How to use:*\n"
+    "1. Click on a link shared by the admin\n"
+    "2. You'll be directed to the URL\n\n"
+    "Contact the admin if you need to share a URL."
+)
+
+HELP_MESSAGE = (
+    "🤖 *URL Sharing Bot Help*\n\n"
+    "I generate Telegram deep links for URLs.\n\n"
+    "🔗 *How to use:*\n"
+    "• Only the admin can generate links\n"
+    "• Click on links shared by the admin\n"
+    "• You'll be directed to the URL\n\n"
+    "📋 *Supported URLs:*\n"
+    "• Website links\n"
+    "• YouTube videos\n"
+    "• Social media posts\n"
+    "• Any valid URL\n\n"
+    "🛠 *Commands:*\n"
+    "/start - Start the bot\n"
+    "/help - Show this help message\n"
+    "/stats - Show statistics (admin only)"
+)
+
+RESULT_TEMPLATE = (
+    "✅ *Telegram Deep Link Generated*\n\n"
+    "🔗 *Your URL:*\n`{url}`\n\n"
+    "➡️ *Telegram Deep Link:*\n`{deep_link}`\n\n"
+    "📤 *Share this link with your users!*"
+)
+
 # ================= DATABASE FUNCTIONS =================
-def init_db():
-    """Initialize the database and create tables if they don't exist"""
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    
-    # Create URLs table
-    cursor.execute('''
-    CREATE TABLE IF NOT EXISTS urls (
+# Statements run on every request. Keeping them as fixed strings means each
+# one is compiled once and then served from the connection's statement cache.
+SQL_INSERT_URL = "INSERT INTO urls (unique_id, original_url, user_id, user_name) VALUES (?, ?, ?, ?)"
+SQL_GET_URL = "SELECT original_url FROM urls WHERE unique_id = ?"
+SQL_GET_LEGACY_URL = "SELECT original_url FROM urls WHERE legacy_id = ?"
+SQL_ADD_CLICKS = "UPDATE urls SET click_count = click_count + ? WHERE unique_id = ?"
+SQL_ADD_LEGACY_CLICKS = "UPDATE urls SET click_count = click_count + ? WHERE legacy_id = ?"
+SQL_COUNT_URLS = "SELECT COUNT(*) FROM urls"
+SQL_SUM_CLICKS = "SELECT SUM(click_count) FROM urls"
+SQL_TOP_URLS = "SELECT original_url, click_count FROM urls ORDER BY click_count DESC LIMIT 5"
+STATEMENT_CACHE_SIZE = 256
+
+# Long-lived connections shared by all handlers. The writer handles inserts
+# and updates; the read-only connection serves lookups. Each is guarded by
+# its own lock since sqlite3 connections must not be used concurrently.
+_conn = None
+_read_conn = None
+_lock = threading.Lock()
+_read_lock = threading.Lock()
+
+# Click increments are buffered in memory and written in batches by flush_clicks
+CLICK_FLUSH_INTERVAL = 10  # seconds
+_click_buffer = collections.Counter()
+_buffer_lock = threading.Lock()
+
+# Mappings never change once stored, so hot deep links are served from memory
+_url_cache = LRUCache(maxsize=10_000)
+_url_cache_lock = threading.Lock()
+
+# Stats don't need to be realtime; repeat /stats calls within the TTL skip the scan
+STATS_CACHE_TTL = 30  # seconds
+_stats_cache = TTLCache(maxsize=1, ttl=STATS_CACHE_TTL)
+_stats_cache_lock = threading.Lock()
+# Bumped on every click flush so a get_stats() that read the table before
+# the flush cannot cache its stale result afterwards
+_stats_generation = 0
+
+def _configure_connection(conn):
+    """Apply per-connection performance PRAGMAs"""
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute("PRAGMA temp_store=MEMORY")
+    conn.execute("PRAGMA cache_size=-20000")  # ~20MB page cache
+    conn.execute("PRAGMA mmap_size=134217728")  # 128MB
+    conn.execute("PRAGMA busy_timeout=5000")
+
+# unique_id holds integer IDs. legacy_id keeps the hex IDs of links created
+# before IDs became integers, exactly as they were issued.
+URLS_TABLE_SQL = '''
+    CREATE TABLE IF NOT EXISTS {table} (
         id INTEGER PRIMARY KEY AUTOINCREMENT,
-        unique_id TEXT UNIQUE NOT NULL,
+        unique_id INTEGER UNIQUE,
         original_url TEXT NOT NULL,
         created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
         click_count INTEGER DEFAULT 0,
         user_id INTEGER,
-        user_name TEXT
+        user_name TEXT,
+        legacy_id TEXT UNIQUE,
+        CHECK (unique_id IS NOT NULL OR legacy_id IS NOT NULL)
     )
-    ''')
+    '''
+
+# Old unique_id values that are exactly an in-range decimal integer. The CAST
+# round trip rejects leading zeros, exponents and values beyond 64 bits.
+_IS_INTEGER_ID_SQL = (
+    "(typeof(unique_id) = 'integer' OR ("
+    "unique_id <> '' AND unique_id NOT GLOB '*[^0-9]*' "
+    "AND CAST(CAST(unique_id AS INTEGER) AS TEXT) = unique_id))"
+)
+# Old unique_id values shaped like the hex digests used for earlier links
+_IS_HEX_ID_SQL = (
+    "(typeof(unique_id) = 'text' AND length(unique_id) IN (16, 32) "
+    "AND unique_id NOT GLOB '*[^0-9a-f]*')"
+)
+
+def _migrate_unique_id_to_integer():
+    """Rebuild a urls table created before the legacy_id column existed.
+    
+    In-range decimal IDs move to the INTEGER unique_id column. Anything that
+    looks like a legacy hex digest, or isn't a clean integer, is copied to
+    legacy_id as text so it is never rewritten by numeric affinity. Digit-only
+    values that could be either are kept in both columns.
+    """
+    columns = {row[1] for row in _conn.execute("PRAGMA table_info(urls)")}
+    if "legacy_id" in columns:
+        return
+    
+    logger.info("Migrating urls.unique_id to INTEGER with legacy_id for hex IDs")
+    with _transaction() as conn:
+        conn.execute(URLS_TABLE_SQL.format(table="urls_new"))
+        conn.execute(
+            "INSERT INTO urls_new "
+            "(id, unique_id, legacy_id, original_url, created_at, click_count, user_id, user_name) "
+            "SELECT id, "
+            f"CASE WHEN {_IS_INTEGER_ID_SQL} THEN CAST(unique_id AS INTEGER) END, "
+            f"CASE WHEN {_IS_INTEGER_ID_SQL} AND NOT {_IS_HEX_ID_SQL} THEN NULL "
+            "ELSE CAST(unique_id AS TEXT) END, "
+            "original_url, created_at, click_count, user_id, user_name FROM urls"
+        )
+        # Every old ID must survive verbatim in one of the new columns;
+        # uniqueness is enforced by the UNIQUE constraints on both
+        altered = conn.execute(
+            "SELECT COUNT(*) FROM urls JOIN urls_new USING (id) "
+            "WHERE NOT (urls_new.legacy_id IS CAST(urls.unique_id AS TEXT) "
+            "OR CAST(urls_new.unique_id AS TEXT) IS CAST(urls.unique_id AS TEXT))"
+        ).fetchone()[0]
+        if altered:
+            raise sqlite3.DatabaseError(f"unique_id migration would alter {altered} IDs")
+        conn.execute("DROP TABLE urls")
+        conn.execute("ALTER TABLE urls_new RENAME TO urls")
+
+def init_db():
+    """Initialize the database, create tables and open the shared connections"""
+    global _conn, _read_conn
+    
+    _conn = sqlite3.connect(
+        DB_PATH,
+        check_same_thread=False,
+        isolation_level=None,
+        cached_statements=STATEMENT_CACHE_SIZE
+    )
+    atexit.register(_conn.close)
+    
+    # WAL lets readers and the writer work concurrently; it is stored in the file
+    _conn.execute("PRAGMA journal_mode=WAL")
+    _configure_connection(_conn)
+    
+    # Create URLs table, upgrading databases created before legacy_id existed
+    _conn.execute(URLS_TABLE_SQL.format(table="urls"))
+    _migrate_unique_id_to_integer()
+    
+    # Lets the top-URLs query read the first rows of the index instead of sorting
+    _conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_urls_click_count ON urls (click_count DESC)"
+    )
+    
+    # The database file exists now, so the read-only connection can be opened
+    _read_conn = sqlite3.connect(
+        f"file:{DB_PATH}?mode=ro",
+        uri=True,
+        check_same_thread=False,
+        cached_statements=STATEMENT_CACHE_SIZE
+    )
+    atexit.register(_read_conn.close)
+    _configure_connection(_read_conn)
+    
+    # Registered last so it runs first at exit, while the connections are open
+    atexit.register(flush_click_buffer)
     
-    conn.commit()
-    conn.close()
     logger.info("Database initialized successfully")
 
+@contextmanager
+def _transaction():
+    """Run a block of writes as one explicit transaction on the writer connection"""
+    with _lock:
+        _conn.execute("BEGIN")
+        try:
+            yield _conn
+            _conn.execute("COMMIT")
+        except BaseException:
+            # A failed COMMIT can leave the transaction open; close it so later
+            # BEGINs work. A failing ROLLBACK is only logged so the original
+            # error is the one that propagates.
+            if _conn.in_transaction:
+                try:
+                    _conn.execute("ROLLBACK")
+                except sqlite3.Error:
+                    logger.exception("Rollback failed")
+            raise
+
+def store_url_mappings(rows):
+    """Store several URL mappings in a single transaction.
+    
+    Each row is a (unique_id, original_url, user_id, user_name) tuple. If any
+    row conflicts, the whole batch is rolled back and IntegrityError is raised.
+    """
+    with _transaction() as conn:
+        conn.executemany(SQL_INSERT_URL, rows)
+    with _url_cache_lock:
+        for unique_id, original_url, _, _ in rows:
+            _url_cache[unique_id] = original_url
+
 def store_url_mapping(unique_id, original_url, user_id, user_name):
     """Store a URL mapping in the database"""
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    
     try:
-        cursor.execute(
-            "INSERT INTO urls (unique_id, original_url, user_id, user_name) VALUES (?, ?, ?, ?)",
-            (unique_id, original_url, user_id, user_name)
-        )
-        conn.commit()
+        store_url_mappings([(unique_id, original_url, user_id, user_name)])
         logger.info(f"Stored URL mapping: {unique_id} -> {original_url}")
     except sqlite3.IntegrityError:
         logger.error(f"Duplicate unique_id: {unique_id}")
-    finally:
-        conn.close()
 
 def get_original_url(unique_id):
-    """Retrieve the original URL for a given unique ID and increment click count"""
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    
-    # Get the URL
-    cursor.execute(
-        "SELECT original_url FROM urls WHERE unique_id = ?",
-        (unique_id,)
-    )
-    result = cursor.fetchone()
+    """Retrieve the original URL for a given unique ID and record a click.
     
-    if result:
-        # Increment click count
-        cursor.execute(
-            "UPDATE urls SET click_count = click_count + 1 WHERE unique_id = ?",
-            (unique_id,)
-        )
-        conn.commit()
+    unique_id is an int, or a str for legacy hex IDs (see decode_id).
+    """
+    with _url_cache_lock:
+        original_url = _url_cache.get(unique_id)
+    
+    if original_url is None:
+        with _read_lock:
+            sql = SQL_GET_LEGACY_URL if isinstance(unique_id, str) else SQL_GET_URL
+            result = _read_conn.execute(sql, (unique_id,)).fetchone()
+        
+        if not result:
+            return None
+        
         original_url = result[0]
-    else:
-        original_url = None
+        with _url_cache_lock:
+            _url_cache[unique_id] = original_url
+    
+    with _buffer_lock:
+        _click_buffer[unique_id] += 1
     
-    conn.close()
     return original_url
 
-def get_stats():
-    """Get statistics about URL usage"""
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    
-    cursor.execute("SELECT COUNT(*) FROM urls")
-    total_urls = cursor.fetchone()[0]
-    
-    cursor.execute("SELECT SUM(click_count) FROM urls")
-    total_clicks = cursor.fetchone()[0] or 0
-    
-    cursor.execute(
-        "SELECT original_url, click_count FROM urls ORDER BY click_count DESC LIMIT 5"
-    )
-    top_urls = cursor.fetchall()
+def flush_click_buffer():
+    """Write buffered click counts to the database in one transaction"""
+    global _click_buffer, _stats_generation
+    
+    with _buffer_lock:
+        if not _click_buffer:
+            return
+        pending, _click_buffer = _click_buffer, collections.Counter()
+    
+    updates = []
+    legacy_updates = []
+    for unique_id, clicks in pending.items():
+        if isinstance(unique_id, str):
+            legacy_updates.append((clicks, unique_id))
+        else:
+            updates.append((clicks, unique_id))
     
-    conn.close()
+    try:
+        with _transaction() as conn:
+            conn.executemany(SQL_ADD_CLICKS, updates)
+            conn.executemany(SQL_ADD_LEGACY_CLICKS, legacy_updates)
+    except sqlite3.Error:
+        # Put the clicks back so they are retried on the next flush
+        with _buffer_lock:
+            _click_buffer.update(pending)
+        raise
+    
+    # New clicks are in the table now, so the next /stats should see them
+    with _stats_cache_lock:
+        _stats_generation += 1
+        _stats_cache.clear()
+    
+    logger.info(f"Flushed clicks for {len(pending)} URLs")
+
+def get_stats():
+    """Get statistics about URL usage, cached for STATS_CACHE_TTL seconds"""
+    with _stats_cache_lock:
+        stats = _stats_cache.get("stats")
+        generation = _stats_generation
+    if stats is not None:
+        return stats
+    
+    stats = _query_stats()
+    
+    with _stats_cache_lock:
+        if generation == _stats_generation:
+            _stats_cache["stats"] = stats
+    return stats
+
+def _query_stats():
+    """Read URL usage statistics from the database"""
+    with _read_lock:
+        cursor = _read_conn.cursor()
+        
+        cursor.execute(SQL_COUNT_URLS)
+        total_urls = cursor.fetchone()[0]
+        
+        cursor.execute(SQL_SUM_CLICKS)
+        total_clicks = cursor.fetchone()[0] or 0
+        
+        cursor.execute(SQL_TOP_URLS)
+        top_urls = cursor.fetchall()
     
     return {
         "total_urls": total_urls,
@@ -119,11 +356,52 @@ def get_stats():
     }
 
 # ================= HELPER FUNCTIONS =================
-def generate_unique_id(url: str) -> str:
-    """Generate a unique identifier for the URL"""
-    # Create a hash of the URL + timestamp to ensure uniqueness
-    unique_string = f"{url}_{time.time()}"
-    return hashlib.md5(unique_string.encode()).hexdigest()
+BASE62_ALPHABET = "0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz"
+_BASE62_INDEX = {char: i for i, char in enumerate(BASE62_ALPHABET)}
+# 62**11 > 2**63, so every ID fits in 11 base62 characters
+MAX_ENCODED_ID_LENGTH = 11
+
+def generate_unique_id() -> int:
+    """Generate a random unique identifier that fits in a signed 64-bit SQLite INTEGER"""
+    return secrets.randbits(63)
+
+def encode_id(unique_id: int) -> str:
+    """Encode an integer ID as a base62 string for use in deep links"""
+    if unique_id == 0:
+        return BASE62_ALPHABET[0]
+    chars = []
+    while unique_id:
+        unique_id, remainder = divmod(unique_id, 62)
+        chars.append(BASE62_ALPHABET[remainder])
+    return "".join(reversed(chars))
+
+def decode_id(encoded: str) -> Optional[Union[int, str]]:
+    """Decode a deep-link parameter back into a unique ID.
+    
+    Returns an int for base62 IDs. Links created before IDs became integers
+    carry hex digests, which are longer than any base62 ID and are returned
+    unchanged as str. Returns None for parameters that cannot be a valid ID.
+    """
+    if len(encoded) > MAX_ENCODED_ID_LENGTH:
+        return encoded
+    unique_id = 0
+    for char in encoded:
+        value = _BASE62_INDEX.get(char)
+        if value is None:
+            return None
+        unique_id = unique_id * 62 + value
+    return unique_id if unique_id < 2 ** 63 else None
+
+_URL_RE = re.compile(r'^https?://').match
+
+_admin_name_cache: dict[int, str] = {}
+
+def _display_name(user) -> str:
+    """Format a user's display name, cached per user id for the process lifetime"""
+    return _admin_name_cache.get(user.id) or _admin_name_cache.setdefault(
+        user.id,
+        f"{user.first_name} {user.last_name or ''} (@{user.username or 'N/A'})"
+    )
 
 # ================= COMMAND HANDLERS =================
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -132,10 +410,12 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     # Check if the command has parameters (like a unique ID)
     if context.args:
-        unique_id = context.args[0]
+        unique_id = decode_id(context.args[0])
         
-        # Get the original URL from the database
-        original_url = get_original_url(unique_id)
+        # Get the original URL from the database without blocking the event loop
+        original_url = None
+        if unique_id is not None:
+            original_url = await asyncio.to_thread(get_original_url, unique_id)
         
         if original_url:
             # Create a button to open the URL
@@ -159,39 +439,14 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
     
     # If no parameters, send the welcome message
-    welcome_message = (
-        f"👋 Hello {user.first_name}!\n\n"
-        "I'm a URL sharing bot. "
-        "Only the admin can generate shareable Telegram links.\n\n"
-        "🔗 *How to use:*\n"
-        "1. Click on a link shared by the admin\n"
-        "2. You'll be directed to the URL\n\n"
-        "Contact the admin if you need to share a URL."
+    await update.message.reply_text(
+        WELCOME_TEMPLATE.format(name=user.first_name),
+        parse_mode="Markdown"
     )
-    
-    await update.message.reply_text(welcome_message, parse_mode="Markdown")
 
 async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Send a help message when the command /help is issued."""
-    help_message = (
-        "🤖 *URL Sharing Bot Help*\n\n"
-        "I generate Telegram deep links for URLs.\n\n"
-        "🔗 *How to use:*\n"
-        "• Only the admin can generate links\n"
-        "• Click on links shared by the admin\n"
-        "• You'll be directed to the URL\n\n"
-        "📋 *Supported URLs:*\n"
-        "• Website links\n"
-        "• YouTube videos\n"
-        "• Social media posts\n"
-        "• Any valid URL\n\n"
-        "🛠 *Commands:*\n"
-        "/start - Start the bot\n"
-        "/help - Show this help message\n"
-        "/stats - Show statistics (admin only)"
-    )
-    
-    await update.message.reply_text(help_message, parse_mode="Markdown")
+    await update.message.reply_text(HELP_MESSAGE, parse_mode="Markdown")
 
 async def stats_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Show statistics about URL usage (admin only)."""
@@ -199,17 +454,19 @@ async def stats_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text("🚫 *Admin only command.*", parse_mode="Markdown")
         return
     
-    stats = get_stats()
+    stats = await asyncio.to_thread(get_stats)
     
-    stats_message = (
+    parts = [
         f"📊 *URL Statistics*\n\n"
         f"• Total URLs shortened: {stats['total_urls']}\n"
         f"• Total clicks: {stats['total_clicks']}\n\n"
         f"🔝 *Top 5 Most Clicked URLs:*\n"
+    ]
+    parts.extend(
+        f"{i}. {clicks} clicks - {url[:50]}...\n"
+        for i, (url, clicks) in enumerate(stats['top_urls'], 1)
     )
-    
-    for i, (url, clicks) in enumerate(stats['top_urls'], 1):
-        stats_message += f"{i}. {clicks} clicks - {url[:50]}...\n"
+    stats_message = "".join(parts)
     
     await update.message.reply_text(stats_message, parse_mode="Markdown")
 
@@ -229,7 +486,7 @@ async def handle_url(update: Update, context: ContextTypes.DEFAULT_TYPE):
     message_text = update.message.text
     
     # Basic URL validation
-    if not message_text.startswith(('http://', 'https://')):
+    if not _URL_RE(message_text):
         await update.message.reply_text(
             "❌ Please send a valid URL starting with http:// or https://",
             parse_mode="Markdown"
@@ -237,21 +494,22 @@ async def handle_url(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
     
     # Generate a unique ID for this URL
-    unique_id = generate_unique_id(message_text)
+    unique_id = generate_unique_id()
     
     # Store the mapping in the database
-    store_url_mapping(
-        unique_id, 
+    await asyncio.to_thread(
+        store_url_mapping,
+        unique_id,
         message_text, 
         user.id, 
-        f"{user.first_name} {user.last_name or ''} (@{user.username or 'N/A'})"
+        _display_name(user)
     )
     
     # Get the bot's username
     bot_username = context.bot.username
     
     # Create the Telegram deep link
-    deep_link = f"https://t.me/{bot_username}?start={unique_id}"
+    deep_link = f"https://t.me/{bot_username}?start={encode_id(unique_id)}"
     
     # Create share buttons
     keyboard = [
@@ -263,15 +521,12 @@ async def handle_url(update: Update, context: ContextTypes.DEFAULT_TYPE):
     reply_markup = InlineKeyboardMarkup(keyboard)
     
     # Send the deep link to the user
-    result_message = (
-        f"✅ *Telegram Deep Link Generated*\n\n"
-        f"🔗 *Your URL:*\n`{message_text}`\n\n"
-        f"➡️ *Telegram Deep Link:*\n`{deep_link}`\n\n"
-        f"📤 *Share this link with your users!*"
+    await update.message.reply_text(
+        RESULT_TEMPLATE.format(url=message_text, deep_link=deep_link),
+        parse_mode="Markdown",
+        reply_markup=reply_markup
     )
     
-    await update.message.reply_text(result_message, parse_mode="Markdown", reply_markup=reply_markup)
-    
     # Log the action
     logger.info(f"Admin {user.id} generated deep link for URL: {message_text} -> {deep_link}")
 
@@ -290,6 +545,11 @@ async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
             parse_mode="Markdown"
         )
 
+# ================= JOBS =================
+async def flush_clicks(context: ContextTypes.DEFAULT_TYPE):
+    """Periodically persist buffered click counts."""
+    await asyncio.to_thread(flush_click_buffer)
+
 # ================= ERROR HANDLER =================
 async def error_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Log errors caused by updates."""
@@ -314,6 +574,9 @@ def main():
     application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_url))
     application.add_handler(CallbackQueryHandler(button_handler))
     
+    # Persist buffered clicks periodically
+    application.job_queue.run_repeating(flush_clicks, interval=CLICK_FLUSH_INTERVAL)
+    
     # Add error handler
     application.add_error_handler(error_handler)
     